@@ -1,10 +1,20 @@
-from sqlalchemy import create_engine, Column, Integer, String
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy import create_engine, Column, ForeignKey, Index, Integer, String
+from sqlalchemy import bindparam, insert, inspect, select
+from sqlalchemy.engine import Engine, Row
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.sql import Select
+from sqlalchemy.orm import relationship, scoped_session, selectinload, sessionmaker
+from sqlalchemy.orm import Session, declarative_base
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy import and_, or_, func
 from sqlalchemy import event
-from typing import Dict, Any, List, Optional
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, Any, Iterator, List, Optional, Tuple, Union
 
 Base = declarative_base()
 
@@ -16,6 +26,10 @@ class Employee(Base):
     last_name = Column(String)
     email = Column(String)
     department = Column(String)
+    department_id = Column(Integer, ForeignKey("departments.id"))
+    # Loaded for all employees of a result in one extra IN query, never per row.
+    # In development the nplusone package can flag lazy loads that slip through.
+    department_rel = relationship("Department", lazy="selectin")
 
     def __repr__(self) -> str:
         return (
@@ -25,6 +39,13 @@ class Employee(Base):
         )
 
 
+# Indexes for the columns read() commonly filters on. Equality, in_ and range
+# operators can use them; the text-matching operators and "regex" still scan.
+Index("ix_emp_dept", Employee.department)
+Index("ix_emp_last_first", Employee.last_name, Employee.first_name)
+Index("ix_emp_email", Employee.email)
+
+
 class Department(Base):
     __tablename__ = "departments"
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -38,190 +59,600 @@ class Department(Base):
         )
 
 
+# read() condition operators, keyed by the name used in the conditions dict
+_OPS = {
+    "eq": lambda c, v: c == v,
+    "lt": lambda c, v: c < v,
+    "gt": lambda c, v: c > v,
+    "lte": lambda c, v: c <= v,
+    "gte": lambda c, v: c >= v,
+    "neq": lambda c, v: c != v,
+    "contains": lambda c, v: c.contains(v),
+    "in_": lambda c, v: c.in_(v),
+    "regex": lambda c, v: c.op("REGEXP")(v),
+    # Matched by SQLite itself; prefer these over "regex", which calls back
+    # into Python for every row. Compared with substr() rather than LIKE, so
+    # they are case-sensitive and "%" or "_" in the value match literally.
+    "startswith": lambda c, v: func.substr(c, 1, func.length(v)) == v,
+    "endswith": lambda c, v: func.substr(c, func.length(c) - func.length(v) + 1) == v,
+    "glob": lambda c, v: c.op("GLOB")(v),
+    # Add more operators as needed
+}
+
+
+def _condition_shape(
+    conditions: Optional[Dict[str, Any]],
+) -> Tuple[Tuple[Tuple[str, str, bool], ...], Tuple[Any, ...]]:
+    """Split read() conditions into a hashable shape and its values, in order.
+
+    Each shape entry is (attr, op, value is None), since comparing with None
+    needs IS / IS NOT rather than a bound parameter.
+    """
+    items = []
+    for attr, condition in (conditions or {}).items():
+        ops = condition if isinstance(condition, dict) else {"eq": condition}
+        items.extend(((attr, op, value is None), value) for op, value in ops.items())
+    items.sort(key=lambda item: item[0])
+    return tuple(key for key, _ in items), tuple(value for _, value in items)
+
+
+def _columns(table: Base) -> Dict[str, Any]:
+    """Column attributes of a model by name, built on first use per class."""
+    # Filters index this dict instead of going through the class descriptor
+    # lookup; __dict__ is checked so a subclass never reuses its parent's map
+    cols = table.__dict__.get("_cols")
+    if cols is None:
+        cols = {c.key: getattr(table, c.key) for c in table.__mapper__.column_attrs}
+        table._cols = cols
+    return cols
+
+
+def _freeze(values: Tuple[Any, ...]) -> Tuple:
+    """Make bound values hashable so they can be part of a cache key."""
+    frozen = []
+    for value in values:
+        if isinstance(value, list):
+            value = tuple(value)
+        elif isinstance(value, set):
+            value = frozenset(value)
+        frozen.append(value)
+    return tuple(frozen)
+
+
+@lru_cache(maxsize=128)
+def _select_for_shape(
+    table: Base, shape: Tuple[Tuple[str, str, bool], ...], core: bool = False
+) -> Tuple[Select, Tuple[str, ...]]:
+    """Build a shape's SELECT and bind parameter names once; values bind per call."""
+    stmt = select(table.__table__ if core else table)
+    names = tuple(f"{attr}__{op}" for attr, op, _ in shape)
+    for (attr, op, is_none), name in zip(shape, names):
+        if op not in _OPS:
+            continue
+        column = _columns(table)[attr]
+        if is_none and op == "eq":
+            stmt = stmt.where(column.is_(None))
+        elif is_none and op == "neq":
+            stmt = stmt.where(column.is_not(None))
+        else:
+            value = bindparam(name, expanding=op == "in_")
+            stmt = stmt.where(_OPS[op](column, value))
+    return stmt, names
+
+
+# Compile each pattern once rather than on every row
+_compile_regex = lru_cache(maxsize=256)(re.compile)
+
+
+def _sqlite_regexp(expr: str, item: Optional[str]) -> bool:
+    """REGEXP function registered on every SQLite connection."""
+    return item is not None and _compile_regex(expr).search(item) is not None
+
+
+class _RowCache:
+    """LRU cache of read_rows() results for one database file, per table."""
+
+    def __init__(self, maxsize: int = 256) -> None:
+        self.maxsize = maxsize
+        self._tables: Dict[str, "OrderedDict[Tuple, List[Row]]"] = {}
+        # Bumped on every drop, so a read that raced a write is not stored
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def generation(self, name: str) -> int:
+        with self._lock:
+            return self._generations.get(name, 0)
+
+    def get(self, name: str, key: Tuple) -> Optional[List[Row]]:
+        with self._lock:
+            entries = self._tables.get(name)
+            if entries is None or key not in entries:
+                return None
+            entries.move_to_end(key)
+            return list(entries[key])
+
+    def put(self, name: str, key: Tuple, rows: List[Row], generation: int) -> None:
+        with self._lock:
+            if self._generations.get(name, 0) != generation:
+                return
+            entries = self._tables.setdefault(name, OrderedDict())
+            entries[key] = rows
+            if len(entries) > self.maxsize:
+                entries.popitem(last=False)
+
+    def drop(self, name: str) -> None:
+        with self._lock:
+            self._tables.pop(name, None)
+            self._generations[name] = self._generations.get(name, 0) + 1
+
+
+def _record_flushed_tables(session: Session, flush_context: Any) -> None:
+    # Still holds what was just flushed, including objects added by cascades
+    written = session.info.setdefault("written_tables", set())
+    for objs in (session.new, session.dirty, session.deleted):
+        for obj in objs:
+            written.update(table.name for table in inspect(obj).mapper.tables)
+
+
+def _record_executed_tables(orm_execute_state: Any) -> None:
+    # Bulk INSERT/UPDATE/DELETE statements bypass the flush
+    state = orm_execute_state
+    if state.is_insert or state.is_update or state.is_delete:
+        written = state.session.info.setdefault("written_tables", set())
+        written.add(state.statement.table.name)
+
+
+_ENGINES: Dict[str, Engine] = {}
+# Number of open SQLiteCRUD instances using each engine in _ENGINES
+_ENGINE_USERS: Dict[str, int] = {}
+# Shared by all instances on a file, so a write through any of them
+# invalidates what the others have cached
+_ROW_CACHES: Dict[str, _RowCache] = {}
+_ENGINES_LOCK = threading.Lock()
+
+
 class SQLiteCRUD:
     def __init__(self, db_name: str) -> None:
-        self.engine = create_engine(f"sqlite:///{db_name}")
+        # Share one engine per database file across instances, so the file,
+        # its pool and the schema checks are set up once per process
+        with _ENGINES_LOCK:
+            if db_name not in _ENGINES:
+                _ENGINES[db_name] = self._make_engine(db_name)
+                _ROW_CACHES[db_name] = _RowCache()
+            _ENGINE_USERS[db_name] = _ENGINE_USERS.get(db_name, 0) + 1
+            self.engine = _ENGINES[db_name]
+            self._row_cache = _ROW_CACHES[db_name]
+        self.db_name = db_name
+        self._closed = False
+        factory = sessionmaker(bind=self.engine)
+        # Track the tables each session writes, whichever call made the change,
+        # and drop their cached rows once the writes are committed or undone
+        event.listen(factory, "after_flush", _record_flushed_tables)
+        event.listen(factory, "do_orm_execute", _record_executed_tables)
+        event.listen(factory, "after_commit", self._drop_written_tables)
+        event.listen(factory, "after_rollback", self._drop_written_tables)
+        self.Session = scoped_session(factory)
+
+    def _drop_written_tables(self, session: Session) -> None:
+        for name in session.info.pop("written_tables", ()):
+            self._row_cache.drop(name)
+
+    @staticmethod
+    def _make_engine(db_name: str) -> Engine:
+        # One pooled connection per thread; WAL lets them read concurrently
+        engine = create_engine(
+            f"sqlite:///{db_name}",
+            poolclass=QueuePool,
+            pool_size=5,
+            max_overflow=10,
+            connect_args={"check_same_thread": False},
+        )
 
-        @event.listens_for(self.engine, "connect")
+        @event.listens_for(engine, "connect")
         def regexp_connection(dbapi_connection, connection_record):
-            import re
-
-            def regexp(expr, item):
-                return re.search(expr, item) is not None
-
-            dbapi_connection.create_function("REGEXP", 2, regexp)
+            dbapi_connection.create_function(
+                "REGEXP", 2, _sqlite_regexp, deterministic=True
+            )
 
-        Base.metadata.create_all(self.engine)
-        self.Session = sessionmaker(bind=self.engine)
-        self.session: Session = self.Session()
+        @event.listens_for(engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            # WAL lets readers run alongside a writer and, with synchronous=NORMAL,
+            # needs a single fsync per commit instead of two
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+            cursor.execute("PRAGMA mmap_size=268435456")
+            cursor.execute("PRAGMA cache_size=-64000")
+            # SQLite ignores REFERENCES clauses unless asked to enforce them
+            cursor.execute("PRAGMA foreign_keys=ON")
+            cursor.close()
+
+        Base.metadata.create_all(engine)
+        # create_all() skips tables that already exist, so add any columns and
+        # indexes declared after the database file was first created
+        inspector = inspect(engine)
+        preparer = engine.dialect.identifier_preparer
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                # SQLite can only add columns that existing rows may leave NULL
+                if column.primary_key or column.unique or not column.nullable:
+                    print(
+                        f"Warning: Could not add column {table.name}.{column.name} "
+                        "to the existing table. Add it by hand or recreate the table."
+                    )
+                    continue
+                ddl = str(CreateColumn(column).compile(dialect=engine.dialect))
+                # create_all() declares foreign keys at table level; inline them here
+                for fk in column.foreign_keys:
+                    target = fk.column
+                    ddl += (
+                        f" REFERENCES {preparer.format_table(target.table)}"
+                        f" ({preparer.quote(target.name)})"
+                    )
+                sql = f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}"
+                with engine.begin() as conn:
+                    conn.exec_driver_sql(sql)
+            for index in table.indexes:
+                index.create(engine, checkfirst=True)
+        return engine
+
+    @contextmanager
+    def transaction(self) -> Iterator[Session]:
+        """Group several writes so they are committed together."""
+        session = self.Session()
+        depth = session.info.get("transaction_depth", 0)
+        if depth == 0:
+            # pysqlite only opens a transaction before INSERT/UPDATE/DELETE, so
+            # a SAVEPOINT issued first would become the transaction itself and
+            # its RELEASE would commit. Open it explicitly; plain reads stay
+            # outside any SQLite transaction and see fresh data.
+            connection = session.connection()
+            if not connection.connection.driver_connection.in_transaction:
+                connection.exec_driver_sql("BEGIN")
+        session.info["transaction_depth"] = depth + 1
+        try:
+            yield session
+            if depth == 0:
+                session.commit()
+        except Exception:
+            if depth == 0:
+                session.rollback()
+            raise
+        finally:
+            session.info["transaction_depth"] = depth
+
+    @contextmanager
+    def _write(self) -> Iterator[Session]:
+        # Inside transaction() a failed write only rolls back its own
+        # SAVEPOINT; otherwise every write is committed on its own.
+        session = self.Session()
+        if session.info.get("transaction_depth", 0):
+            with session.begin_nested():
+                yield session
+            return
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
 
     def insert(self, obj: Base) -> None:
         try:
-            self.session.add(obj)
-            self.session.commit()
+            with self._write() as session:
+                session.add(obj)
+                session.flush()
         except IntegrityError:
-            self.session.rollback()
             print(
                 f"Warning: Could not insert {obj}. A unique constraint was violated."
             )
         except Exception as e:
-            self.session.rollback()
             print(f"Error: {e}")
 
+    def insert_many(
+        self, table: Base, rows: List[Dict[str, Any]], skip_existing: bool = False
+    ) -> None:
+        if not rows:
+            return
+        stmt = insert(table)
+        if skip_existing:
+            # Rows that violate a unique constraint (e.g. already exist) are
+            # skipped instead of rejecting the whole batch
+            stmt = stmt.prefix_with("OR IGNORE")
+        try:
+            with self._write() as session:
+                # A single executemany INSERT for the whole batch
+                session.execute(stmt, rows)
+        except IntegrityError:
+            print(
+                f"Warning: Could not insert {len(rows)} {table.__tablename__} rows. "
+                "A unique constraint was violated."
+            )
+        except Exception as e:
+            print(f"Error: {e}")
+
+    def insert_returning(self, table: Base, rows: List[Dict[str, Any]]) -> List[int]:
+        if not rows:
+            return []
+        primary_key = table.__mapper__.primary_key[0]
+        # One multi-row INSERT ... RETURNING; ids come back in the order of rows
+        stmt = insert(table).returning(primary_key, sort_by_parameter_order=True)
+        try:
+            with self._write() as session:
+                return list(session.execute(stmt, rows).scalars())
+        except IntegrityError:
+            print(
+                f"Warning: Could not insert {len(rows)} {table.__tablename__} rows. "
+                "A unique constraint was violated."
+            )
+        except Exception as e:
+            print(f"Error: {e}")
+        return []
+
+    def insert_all(self, objs: List[Base], skip_existing: bool = False) -> None:
+        rows_by_table: Dict[Any, List[Dict[str, Any]]] = {}
+        for obj in objs:
+            table = type(obj)
+            rows_by_table.setdefault(table, []).append(
+                {c.key: getattr(obj, c.key) for c in table.__table__.columns}
+            )
+        for table, rows in rows_by_table.items():
+            self.insert_many(table, rows, skip_existing)
+
     def read(
+        self,
+        table: Base,
+        conditions: Optional[Dict[str, Any]] = None,
+        *,
+        stream: bool = False,
+        chunk_size: int = 1000,
+        eager: Tuple[str, ...] = (),
+    ) -> Union[List[Base], Iterator[Base]]:
+        session = self.Session()
+        options = [selectinload(getattr(table, name)) for name in eager]
+        # Only inside transaction() is the identity map known to be current;
+        # outside it the session is never committed after reads, so get()
+        # could return rows another connection has since changed or deleted
+        in_transaction = session.info.get("transaction_depth", 0)
+        if in_transaction and conditions and len(conditions) == 1 and not stream:
+            ((attr, value),) = conditions.items()
+            primary_key = table.__mapper__.primary_key
+            if (
+                value is not None
+                and not isinstance(value, dict)
+                and len(primary_key) == 1
+                and primary_key[0].key == attr
+            ):
+                # Served from the identity map when already loaded, else one
+                # SELECT by primary key
+                obj = session.get(table, value, options=options)
+                return [obj] if obj is not None else []
+        shape, values = _condition_shape(conditions)
+        stmt, names = _select_for_shape(table, shape)
+        params = dict(zip(names, values))
+        if options:
+            stmt = stmt.options(*options)
+        if stream:
+            # Fetch and build objects chunk_size rows at a time instead of all at once
+            return session.execute(
+                stmt, params, execution_options={"yield_per": chunk_size}
+            ).scalars()
+        return session.execute(stmt, params).scalars().all()
+
+    def read_rows(
         self, table: Base, conditions: Optional[Dict[str, Any]] = None
-    ) -> List[Base]:
-        query = self.session.query(table)
-        if conditions:
-            for attr, condition in conditions.items():
-                if isinstance(condition, dict):
-                    for op, value in condition.items():
-                        if op == "lt":
-                            query = query.filter(getattr(table, attr) < value)
-                        elif op == "gt":
-                            query = query.filter(getattr(table, attr) > value)
-                        elif op == "lte":
-                            query = query.filter(getattr(table, attr) <= value)
-                        elif op == "gte":
-                            query = query.filter(getattr(table, attr) >= value)
-                        elif op == "neq":
-                            query = query.filter(getattr(table, attr) != value)
-                        elif op == "contains":
-                            query = query.filter(getattr(table, attr).contains(value))
-                        elif op == "in_":
-                            query = query.filter(getattr(table, attr).in_(value))
-                        elif op == "regex":
-                            query = query.filter(
-                                getattr(table, attr).op("REGEXP")(value)
-                            )
-                        # Add more operators as needed
-                else:
-                    query = query.filter(getattr(table, attr) == condition)
-        return query.all()
+    ) -> List[Row]:
+        # Read-only fast path: plain Core rows, skipping ORM object construction
+        # and the identity map. Runs on the session's connection so it sees
+        # writes made earlier in the same transaction().
+        shape, values = _condition_shape(conditions)
+        session = self.Session()
+        # Like the ORM's autoflush, so pending changes are seen and recorded
+        session.flush()
+        name = table.__tablename__
+        # Skip the cache for tables written earlier in the current transaction()
+        use_cache = name not in session.info.get("written_tables", ())
+        key = (shape, _freeze(values))
+        if use_cache:
+            cached = self._row_cache.get(name, key)
+            if cached is not None:
+                return cached
+            generation = self._row_cache.generation(name)
+        stmt, names = _select_for_shape(table, shape, core=True)
+        rows = session.connection().execute(stmt, dict(zip(names, values))).all()
+        # Rows read inside transaction() may include uncommitted writes
+        if use_cache and not session.info.get("transaction_depth", 0):
+            self._row_cache.put(name, key, rows, generation)
+            return list(rows)
+        return rows
 
     def update(
         self, table: Base, conditions: Dict[str, Any], data: Dict[str, Any]
     ) -> None:
-        query = self.session.query(table)
-        for attr, value in conditions.items():
-            query = query.filter(getattr(table, attr) == value)
-        query.update(data)
-        self.session.commit()
+        # A single UPDATE statement without the pre-SELECT that syncs loaded
+        # objects. The commit expires them; inside transaction() there is no
+        # commit yet, so they are expired here instead (no SQL is emitted).
+        with self._write() as session:
+            query = session.query(table)
+            columns = _columns(table)
+            for attr, value in conditions.items():
+                query = query.filter(columns[attr] == value)
+            query.update(data, synchronize_session=False)
+            if session.info.get("transaction_depth", 0):
+                session.expire_all()
 
     def delete(self, table: Base, conditions: Dict[str, Any]) -> None:
-        query = self.session.query(table)
-        for attr, value in conditions.items():
-            query = query.filter(getattr(table, attr) == value)
-        query.delete()
-        self.session.commit()
+        # Single DELETE, no sync pre-SELECT; see update() about loaded objects
+        with self._write() as session:
+            query = session.query(table)
+            columns = _columns(table)
+            for attr, value in conditions.items():
+                query = query.filter(columns[attr] == value)
+            query.delete(synchronize_session=False)
+            if session.info.get("transaction_depth", 0):
+                session.expire_all()
 
     def close(self) -> None:
-        self.session.close()
+        self.Session.remove()
+        with _ENGINES_LOCK:
+            if self._closed:
+                return
+            self._closed = True
+            _ENGINE_USERS[self.db_name] -= 1
+            if _ENGINE_USERS[self.db_name]:
+                return
+            # Last user of this file: closing the pooled connections
+            # checkpoints and removes the WAL files
+            del _ENGINE_USERS[self.db_name]
+            del _ENGINES[self.db_name]
+            del _ROW_CACHES[self.db_name]
+        self.engine.dispose()
 
 
 if __name__ == "__main__":
     # Example usage:
     db = SQLiteCRUD("company.db")
 
-    # Insert a new employee
-    db.insert(
-        Employee(
-            id=1,
-            first_name="John",
-            last_name="Doe",
-            email="john.doe@example.com",
-            department="Engineering",
+    # Run the employee writes and reads under a single commit
+    with db.transaction():
+        # Insert employees in a single batch, keeping any that already exist
+        db.insert_all(
+            [
+                Employee(
+                    id=1,
+                    first_name="John",
+                    last_name="Doe",
+                    email="john.doe@example.com",
+                    department="Engineering",
+                ),
+                Employee(
+                    id=2,
+                    first_name="Jane",
+                    last_name="Smith",
+                    email="jane.smith@example.com",
+                    department="Marketing",
+                ),
+                Employee(
+                    id=3,
+                    first_name="Alice",
+                    last_name="Johnson",
+                    email="alice.johnson@example.com",
+                    department="Engineering",
+                ),
+            ],
+            skip_existing=True,
+        )
+
+        # Read employees from the 'Engineering' department
+        print(
+            "Engineering Department:",
+            db.read_rows(Employee, {"department": "Engineering"}),
         )
-    )
-
-    # Insert more employees
-    db.insert(
-        Employee(
-            id=2,
-            first_name="Jane",
-            last_name="Smith",
-            email="jane.smith@example.com",
-            department="Marketing",
+
+        # Read employees with the last name 'Smith'
+        print(
+            "Employees with last name Smith:",
+            db.read_rows(Employee, {"last_name": "Smith"}),
         )
-    )
-    db.insert(
-        Employee(
-            id=3,
-            first_name="Alice",
-            last_name="Johnson",
-            email="alice.johnson@example.com",
-            department="Engineering",
+
+        # Read employees with the first name 'Alice' and department 'Engineering'
+        print(
+            "Alice in Engineering:",
+            db.read_rows(
+                Employee, {"first_name": "Alice", "department": "Engineering"}
+            ),
         )
-    )
 
-    # Read employees from the 'Engineering' department
-    print("Engineering Department:", db.read(Employee, {"department": "Engineering"}))
+        # Read the 'employees' table
+        print("All employees:", db.read_rows(Employee))
 
-    # Read employees with the last name 'Smith'
-    print("Employees with last name Smith:", db.read(Employee, {"last_name": "Smith"}))
+        # Stream the 'employees' table in chunks instead of loading it all at once
+        for employee in db.read(Employee, stream=True, chunk_size=100):
+            print("Streamed employee:", employee)
 
-    # Read employees with the first name 'Alice' and department 'Engineering'
-    print(
-        "Alice in Engineering:",
-        db.read(Employee, {"first_name": "Alice", "department": "Engineering"}),
-    )
+        # Update an employee's email
+        db.update(Employee, {"id": 1}, {"email": "j.doe@example.com"})
 
-    # Read the 'employees' table
-    print("All employees:", db.read(Employee))
+        # Verify the update operation
+        print("Updated employee with id 1:", db.read_rows(Employee, {"id": 1}))
 
-    # Update an employee's email
-    db.update(Employee, {"id": 1}, {"email": "j.doe@example.com"})
+        # Read the 'employees' table again
+        print("All employees after update:", db.read_rows(Employee))
 
-    # Verify the update operation
-    print("Updated employee with id 1:", db.read(Employee, {"id": 1}))
+        # Delete an employee
+        db.delete(Employee, {"id": 1})
 
-    # Read the 'employees' table again
-    print("All employees after update:", db.read(Employee))
+        # Read the 'employees' table one more time
+        print("All employees after deletion:", db.read_rows(Employee))
 
-    # Delete an employee
-    db.delete(Employee, {"id": 1})
+        # Example of using new filters
+        print(
+            "Employees with id greater than 1:",
+            db.read_rows(Employee, {"id": {"gt": 1}}),
+        )
+        print(
+            "Employees with first name containing 'Jane':",
+            db.read_rows(Employee, {"first_name": {"contains": "Jane"}}),
+        )
+        print(
+            "Employees with id less than or equal to 3:",
+            db.read_rows(Employee, {"id": {"lte": 3}}),
+        )
+        print(
+            "Employees with id not equal to 2:",
+            db.read_rows(Employee, {"id": {"neq": 2}}),
+        )
+        print(
+            "Employees with id in [1, 3]:",
+            db.read_rows(Employee, {"id": {"in_": [1, 3]}}),
+        )
+        print(
+            "Employees with email ending in '@example.com':",
+            db.read_rows(Employee, {"email": {"endswith": "@example.com"}}),
+        )
 
-    # Read the 'employees' table one more time
-    print("All employees after deletion:", db.read(Employee))
+    # Run the department writes and reads under a single commit
+    with db.transaction():
+        # Insert departments in a single batch, keeping any that already exist
+        db.insert_many(
+            Department,
+            [
+                {"id": 1, "name": "Engineering", "location": "Building A"},
+                {"id": 2, "name": "Marketing", "location": "Building B"},
+                {"id": 3, "name": "HR", "location": "Building C"},
+            ],
+            skip_existing=True,
+        )
 
-    # Example of using new filters
-    print("Employees with id greater than 1:", db.read(Employee, {"id": {"gt": 1}}))
-    print(
-        "Employees with first name containing 'Jane':",
-        db.read(Employee, {"first_name": {"contains": "Jane"}}),
-    )
-    print(
-        "Employees with id less than or equal to 3:",
-        db.read(Employee, {"id": {"lte": 3}}),
-    )
-    print("Employees with id not equal to 2:", db.read(Employee, {"id": {"neq": 2}}))
-    print("Employees with id in [1, 3]:", db.read(Employee, {"id": {"in_": [1, 3]}}))
-    print(
-        "Employees with email matching regex '.*@example.com':",
-        db.read(Employee, {"email": {"regex": ".*@example.com"}}),
-    )
+        # Read departments
+        print("All departments:", db.read_rows(Department))
 
-    # Insert a new department
-    db.insert(Department(id=1, name="Engineering", location="Building A"))
+        # Link employees to their department rows
+        db.update(Employee, {"department": "Engineering"}, {"department_id": 1})
+        db.update(Employee, {"department": "Marketing"}, {"department_id": 2})
 
-    # Insert more departments
-    db.insert(Department(id=2, name="Marketing", location="Building B"))
-    db.insert(Department(id=3, name="HR", location="Building C"))
+        # Load each employee's department with the employees, not one query per access
+        employees = db.read(Employee, eager=("department_rel",))
+        print("Employee departments:", [e.department_rel for e in employees])
 
-    # Read departments
-    print("All departments:", db.read(Department))
+        # Update a department's location
+        db.update(Department, {"id": 1}, {"location": "Building D"})
 
-    # Update a department's location
-    db.update(Department, {"id": 1}, {"location": "Building D"})
+        # Verify the update operation
+        print("Updated department with id 1:", db.read_rows(Department, {"id": 1}))
 
-    # Verify the update operation
-    print("Updated department with id 1:", db.read(Department, {"id": 1}))
+        # Unlink its employees first, since the foreign key is enforced
+        db.update(Employee, {"department_id": 1}, {"department_id": None})
 
-    # Delete a department
-    db.delete(Department, {"id": 1})
+        # Delete a department
+        db.delete(Department, {"id": 1})
 
-    # Read the 'departments' table one more time
-    print("All departments after deletion:", db.read(Department))
+        # Read the 'departments' table one more time
+        print("All departments after deletion:", db.read_rows(Department))
 
     # Close the database connection
     db.close()